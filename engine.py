@@ -1,5 +1,21 @@
+import copy
 import datetime
+import hashlib
+import itertools
+import json
+import operator
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import bisect
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
+from enum import IntEnum
+import numpy as np
 import pandas as pd
 
 try:
@@ -8,10 +24,193 @@ except ImportError:
     print("yfinance not installed. 'yahoo' source will not work.")
     yf = None
 
+try:
+    import requests
+except ImportError:
+    print("requests not installed. 'spark' source will not work.")
+    requests = None
+
+try:
+    from numba import njit
+except ImportError:  # numba only speeds up the synthetic data, everything works without it
+    njit = None
+
+YAHOO_BATCH_SIZE = 20  # yahoo caps how many symbols go in one request
+YAHOO_CACHE_TTL = 86400  # seconds a downloaded frame stays valid on disk
+YAHOO_RECENT_TTL = 900  # shorter limit for windows ending today or later, their latest bars still change
+YAHOO_MEMORY_TTL = 900  # seconds a frame is reused from memory before the disk cache is asked again
+YAHOO_MEMORY_SIZE = 64  # most recent frames kept in memory
+YAHOO_CACHE_VERSION = 3  # bump when the layout of cached frames changes so old entries are ignored
+SPARK_URL = 'https://query1.finance.yahoo.com/v8/finance/spark'
+SPARK_INTERVALS = frozenset(['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d'])
+# spark only takes a lookback range ending today, pick the shortest one that reaches start_date
+SPARK_RANGES = [('1d', 1), ('5d', 5), ('1mo', 31), ('3mo', 92), ('6mo', 183),
+                ('1y', 366), ('2y', 731), ('5y', 1827), ('10y', 3653)]
+
+
+class FileCache:  # keeps pickled DataFrames on disk so repeated queries skip the network
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _paths(self, key):
+        name = hashlib.md5(key.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, name)
+        return base + '.pkl', base + '.json'
+
+    def get(self, key, ttl=None):
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if ttl is not None and time.time() - meta['ts'] > ttl:
+                return None  # too old, let the caller download again
+            with open(data_path, 'rb') as f:
+                return pickle.loads(f.read())
+        except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+            return None  # missing, empty or half-written entries count as a miss
+
+    def set(self, key, df):
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, meta_path = self._paths(key)
+        self._write(data_path, pickle.dumps(df))
+        # sidecar is written last, so get() never sees a partial pickle as fresh
+        self._write(meta_path, json.dumps({'key': key, 'ts': time.time()}).encode('utf-8'))
+
+    def _write(self, path, data):
+        # write to a private temp file and swap it in, so threads saving the same key never interleave
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+yahoo_cache = FileCache(os.path.join('.cache', 'yahoo'))
+
+
+def _yahoo_cache_ttl(end_s):
+    # past windows no longer change, a window reaching today has to be refreshed during the day
+    return YAHOO_RECENT_TTL if end_s >= datetime.date.today().isoformat() else YAHOO_CACHE_TTL
+
+
+def _drop_ticker_level(df):
+    # single-ticker yahoo frames are labelled ('Close', 'AAPL'), or ('AAPL', 'Close') with group_by='ticker';
+    # the ticker level is dropped when it holds one ticker, anything else is returned unchanged
+    if isinstance(df.columns, pd.MultiIndex) and df.columns.nlevels == 2:
+        names = list(df.columns.names)
+        ticker_level = names.index('Ticker') if 'Ticker' in names else 1
+        if df.columns.get_level_values(ticker_level).nunique() == 1:
+            return df.droplevel(ticker_level, axis=1)
+    return df
+
+
+def _with_date_column(df):
+    # like reset_index() with the date column named 'date', built in one go from the column arrays.
+    # .array keeps extension dtypes, e.g. the New York timezone on yahoo's intraday index
+    df = _drop_ticker_level(df)
+    return pd.DataFrame({'date': df.index.array, **{c: df[c].array for c in df.columns}})
+
+
+# yf.download collects its results in module-global state (yfinance.shared._DFS), so two downloads
+# running at once can mix up each other's frames; the batched download in fetch_many holds this lock.
+# single symbols go through yf.Ticker(symbol).history, which keeps its state per ticker and runs fine on threads
+_yf_download_lock = threading.Lock()
+
+_yahoo_memory = OrderedDict()  # key -> (time stored, frame), least recently used first
+_yahoo_memory_lock = threading.Lock()
+
+
+def _yahoo_download(symbol, start_s, end_s, interval):
+    # repeats within the process are answered from memory, then from the disk cache, then from yahoo
+    key = f'v{YAHOO_CACHE_VERSION}|{symbol}|{start_s}|{end_s}|{interval}'
+    ttl = _yahoo_cache_ttl(end_s)  # windows reaching today get the short limit in memory and on disk
+    with _yahoo_memory_lock:
+        hit = _yahoo_memory.get(key)
+        if hit is not None and time.time() - hit[0] <= min(YAHOO_MEMORY_TTL, ttl):
+            _yahoo_memory.move_to_end(key)
+            return hit[1]
+
+    df = yahoo_cache.get(key, ttl=ttl)
+    if df is None:
+        df = yf.Ticker(symbol).history(start=start_s, end=end_s, interval=interval)  # input your parameter
+        df = _with_date_column(df)
+        if df.empty:  # yahoo answers failures with an empty frame instead of raising, try again next time
+            return df
+        yahoo_cache.set(key, df)
+
+    with _yahoo_memory_lock:
+        _yahoo_memory[key] = (time.time(), df)
+        _yahoo_memory.move_to_end(key)
+        while len(_yahoo_memory) > YAHOO_MEMORY_SIZE:
+            _yahoo_memory.popitem(last=False)
+    return df
+
+
+# straight line of prices used by the synthetic sources: base, base + step, base + 2*step, ...
+if njit is not None:
+    @njit(cache=True)
+    def _fill_linear(n, base=100.0, step=0.5):
+        out = np.empty(n)
+        for i in range(n):
+            out[i] = base + i * step
+        return out
+
+    _fill_linear(1)  # compile now (or load from numba's disk cache) instead of on the first fetch
+else:
+    def _fill_linear(n, base=100.0, step=0.5):
+        return np.arange(n, dtype=np.float64) * step + base
+
+
+# fixed-length pandas aliases in nanoseconds; calendar ones ('W', 'MS', '3MS') are not listed
+_MINUTE_NS = 60 * 1_000_000_000
+_FIXED_FREQ_NS = {'T': _MINUTE_NS,
+                  '2T': 2 * _MINUTE_NS,
+                  '5T': 5 * _MINUTE_NS,
+                  '15T': 15 * _MINUTE_NS,
+                  '30T': 30 * _MINUTE_NS,
+                  '60T': 60 * _MINUTE_NS,
+                  '90T': 90 * _MINUTE_NS,
+                  'H': 60 * _MINUTE_NS,
+                  'D': 1440 * _MINUTE_NS,
+                  '5D': 5 * 1440 * _MINUTE_NS}
+
+
+def _date_range(start, end, pd_freq):
+    # same dates as pd.date_range(start, end, freq=pd_freq), fixed steps are laid out directly with np.arange
+    step = _FIXED_FREQ_NS.get(pd_freq)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    # calendar steps, timezones and NaT (which pd.date_range rejects) all go through pandas
+    if step is None or pd.isna(start) or pd.isna(end) or start.tz is not None or end.tz is not None:
+        return pd.date_range(start=start, end=end, freq=pd_freq)
+    try:
+        start_ns, end_ns = start.as_unit('ns').value, end.as_unit('ns').value
+    except (OverflowError, ValueError):  # outside the nanosecond range, let pandas raise OutOfBoundsDatetime
+        return pd.date_range(start=start, end=end, freq=pd_freq)
+    values = np.arange(start_ns, end_ns + 1, step, dtype='i8')
+    return pd.DatetimeIndex(values.view('datetime64[ns]'))
+
 
 class MarketDataQuery:
+    _FREQ_MAP = {'1m': 'T', # yahoo interval -> pandas alias
+                 '2m': '2T',
+                 '5m': '5T',
+                 '15m': '15T',
+                 '30m': '30T',
+                 '60m': '60T',
+                 '90m': '90T',
+                 '1h': 'H',
+                 '1d': 'D',
+                 '5d': '5D',
+                 '1wk': 'W',
+                 '1mo': 'MS',
+                 '3mo': '3MS'}
+    _VALID_FREQS = frozenset(_FREQ_MAP)  # built once for the class, not per query
+
     def __init__(self,
-                 symbol: str,  # symbol means permno
+                 symbol,  # symbol means permno, a list of symbols is fetched in one batch
                  time_frame: str,
                  start_date: str,
                  end_date: str,
@@ -19,70 +218,216 @@ class MarketDataQuery:
                  source: str = 'yahoo'): # default source is yahoo, it will ask yfinance to provide the data
         self.symbol = symbol
         self.time_frame = time_frame
-        self.start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')  # convert string to datetime, opposite to strftime
-        self.end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d')
+        self.start_date = self._parse_date(start_date)  # convert string to datetime, pandas parses it in C
+        self.end_date = self._parse_date(end_date)
         self.frequency = frequency
         self.source = source
 
         self._validate()
 
+    @staticmethod
+    def _parse_date(value):
+        # strict '%Y-%m-%d' like strptime; '' and None come back as NaT and are refused in _validate
+        try:
+            ts = pd.to_datetime(value, format='%Y-%m-%d')
+        except pd.errors.OutOfBoundsDatetime:
+            raise
+        except (ValueError, TypeError):
+            raise ValueError('Start and end dates must be plain dates in YYYY-MM-DD format') from None
+        return pd.NaT if pd.isna(ts) else ts.to_pydatetime()
+
     # you have to validate your query condition each time
     def _validate(self):
+        for d in (self.start_date, self.end_date):
+            # '' or None parse to NaT, datetime objects may carry a time or timezone, only plain dates are allowed
+            if pd.isna(d) or d.tzinfo is not None or d.time() != datetime.time(0):
+                raise ValueError('Start and end dates must be plain dates in YYYY-MM-DD format')
+
         if self.start_date > self.end_date:
             raise ValueError('Start date must be before end date')
-        valid_frequencies = ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo']
 
-        if self.frequency not in valid_frequencies:
-            raise ValueError('Frequency must be one of {}'.format(valid_frequencies))
+        if self.frequency not in self._VALID_FREQS:
+            raise ValueError('Frequency must be one of {}'.format(list(self._FREQ_MAP)))
 
     def fetch(self):
+        if isinstance(self.symbol, (list, tuple)):
+            return self.fetch_many(self.symbol)
+
         if self.source == 'test':
 
-            freq_map = {'1m': 'T', # these are pandas alias
-                        '2m': '2T',
-                        '5m': '5T',
-                        '15m': '15T',
-                        '30m': '30T',
-                        '60m': '60T',
-                        '90m': '90T',
-                        '1h': 'H',
-                        '1d': 'D',
-                        '5d': '5D',
-                        '1wk': 'W',
-                        '1mo': 'MS',
-                        '3mo': '3MS'} # 'D'
-            pd_freq = freq_map.get(self.frequency)
+            pd_freq = self._FREQ_MAP.get(self.frequency)
             if not pd_freq:
                 raise ValueError('Test source does not support frequency: {self.frequency}')
 
-            dates = pd.date_range(start=self.start_date, end=self.end_date, freq=pd_freq) # get() looks up value of self.frequency in freq_map
+            dates = _date_range(self.start_date, self.end_date, pd_freq) # get() looks up value of self.frequency in _FREQ_MAP
             if len(dates) == 0 and self.start_date <= self.end_date: # Handle case where start/end are same day
                 dates = pd.to_datetime([self.start_date]) # set the start_date as dates
 
-            prices = [100 + i*0.5 for i in range(len(dates))]  # add 0.5 each day
+            prices = _fill_linear(len(dates))  # add 0.5 each day
 
-            df = pd.DataFrame({'date': dates, 'price': prices})
+            df = pd.DataFrame({'date': dates.array, 'price': prices})
             return df
 
         elif self.source == 'yahoo':
             if yf is None:
                 raise ImportError("yfinance is not installed. Cannot use 'yahoo' source.")
 
-            df = yf.download( # input your parameter
-                self.symbol,
-                start=self.start_date.strftime('%Y-%m-%d'), # convert the datetime object to string, then send it to API
-                end=self.end_date.strftime('%Y-%m-%d'),
-                interval=self.frequency,
-            )
-            df.reset_index(inplace=True)
-            return df
+            # convert the datetime objects to strings, then send them to the API
+            df = _yahoo_download(self.symbol, self.start_date.strftime('%Y-%m-%d'),
+                                 self.end_date.strftime('%Y-%m-%d'), self.frequency)
+            return df.copy()  # the cached frame is shared, callers get their own
+
+        elif self.source == 'spark':  # close prices only, from yahoo's lightweight spark endpoint
+            if self.frequency not in SPARK_INTERVALS:
+                return self._with_source('yahoo').fetch()  # spark has no weekly/monthly bars
+            return self._spark_fetch([self.symbol])[self.symbol]
 
         else:
             raise ValueError(f'Unknown source: {self.source}')
 
+    def _with_source(self, source):
+        query = copy.copy(self)
+        query.source = source
+        return query
+
+    def _spark_fetch(self, symbols):
+        # returns {symbol: DataFrame(date, close)}, asking for up to YAHOO_BATCH_SIZE symbols per request
+        if requests is None:
+            raise ImportError("requests is not installed. Cannot use 'spark' source.")
+
+        days_back = (datetime.datetime.now() - self.start_date).days + 1
+        lookback = next((name for name, days in SPARK_RANGES if days >= days_back), 'max')
+
+        frames = {}
+        for i in range(0, len(symbols), YAHOO_BATCH_SIZE):
+            chunk = symbols[i:i + YAHOO_BATCH_SIZE]
+            tickers = [sym.upper() for sym in chunk]
+            r = requests.get(
+                SPARK_URL,
+                params={'symbols': ','.join(tickers), 'range': lookback, 'interval': self.frequency},
+                headers={'User-Agent': 'Mozilla/5.0'},  # yahoo rejects requests without one
+                timeout=30,
+            )
+            r.raise_for_status()
+            by_ticker = {}
+            for result in r.json()['spark']['result'] or []:
+                response = result['response'][0]
+                dates = pd.to_datetime(response.get('timestamp', []), unit='s')
+                closes = response['indicators']['quote'][0].get('close', [])
+                df = pd.DataFrame({'date': dates, 'close': np.asarray(closes, dtype=np.float64)})
+                # the range ends today, keep only the queried window (end is exclusive, like yf.download)
+                in_window = (df['date'] >= self.start_date) & (df['date'] < self.end_date)
+                by_ticker[result['symbol'].upper()] = df[in_window].reset_index(drop=True)
+
+            for sym, ticker in zip(chunk, tickers):  # results are keyed by the symbol as the caller wrote it
+                if ticker not in by_ticker:
+                    raise ValueError(f'Spark returned no data for symbol: {sym}')
+                frames[sym] = by_ticker[ticker]
+        return frames
+
+    def fetch_many(self, symbols):
+        # returns {symbol: DataFrame}, yahoo symbols are downloaded together instead of one request each
+        symbols = list(symbols)
+        if self.source == 'spark':
+            if self.frequency not in SPARK_INTERVALS:
+                return self._with_source('yahoo').fetch_many(symbols)
+            return self._spark_fetch(symbols)
+
+        if self.source != 'yahoo':
+            frames = {}
+            for sym in symbols:
+                query = copy.copy(self)
+                query.symbol = sym
+                frames[sym] = query.fetch()
+            return frames
+
+        if yf is None:
+            raise ImportError("yfinance is not installed. Cannot use 'yahoo' source.")
+
+        frames = {}
+        for i in range(0, len(symbols), YAHOO_BATCH_SIZE):
+            chunk = symbols[i:i + YAHOO_BATCH_SIZE]
+            tickers = [sym.upper() for sym in chunk]  # yfinance labels its columns with upper-case tickers
+            with _yf_download_lock:
+                df = yf.download(
+                    ' '.join(tickers),
+                    start=self.start_date.strftime('%Y-%m-%d'),
+                    end=self.end_date.strftime('%Y-%m-%d'),
+                    interval=self.frequency,
+                    group_by='ticker',
+                    threads=True,
+                    progress=False,
+                )
+            for sym, ticker in zip(chunk, tickers):  # results are keyed by the symbol as the caller wrote it
+                # older yfinance returns flat columns when only one ticker is asked for
+                if isinstance(df.columns, pd.MultiIndex):
+                    if ticker not in df.columns.get_level_values(0):
+                        raise ValueError(f'Yahoo returned no data for symbol: {sym}')
+                    sym_df = df[ticker]
+                else:
+                    sym_df = df
+                frames[sym] = _with_date_column(sym_df.dropna(how='all'))  # tickers can trade on different days
+        return frames
+
+
+def fetch_queries(queries, threads=None):
+    # runs each query's fetch() on its own thread and returns the results in the same order as queries.
+    # the time is spent waiting on HTTP responses and disk reads, which release the GIL, so the yahoo,
+    # spark and cache lookups of different queries overlap. queries holding a list of symbols use the
+    # batched yf.download, and those take turns (see _yf_download_lock)
+    queries = list(queries)
+    if not queries:
+        return []
+
+    results = [None] * len(queries)
+    with ThreadPoolExecutor(max_workers=threads or min(32, len(queries))) as ex:
+        futures = {ex.submit(q.fetch): i for i, q in enumerate(queries)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()  # re-raises any error from the worker
+    return results
+
+
+def format_timestamp(ts):
+    # orders keep time.time_ns() integers, only turn them into text when someone reads them
+    if isinstance(ts, (int, np.integer)):
+        return datetime.datetime.fromtimestamp(ts / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+    return ts
+
+
+# status codes used by the array based order containers, indexes into STATUS_NAMES
+STATUS_PENDING = np.uint8(0)
+STATUS_FILLED = np.uint8(1)
+STATUS_CANCELLED = np.uint8(2)
+STATUS_NAMES = ('pending', 'filled', 'cancelled')
+
+# one record per submitted order in MockBrokerConnector's history ring buffer
+# sym is a code into MockBrokerConnector.symbols, px the limit price until the order executes, then its average fill price
+ORDER_DTYPE = np.dtype([('id', 'i8'), ('sym', 'i4'), ('side', 'u1'), ('qty', 'f8'), ('px', 'f8'), ('ts', 'i8'), ('status', 'u1')])
+ORDER_HISTORY_SIZE = 1 << 20  # newest orders overwrite the oldest past this many
+
+
+class Side(IntEnum):  # order side, compared by identity on the hot paths
+    BUY = 0
+    SELL = 1
+
+
+def _to_side(side):
+    # accepts Side or 'buy'/'SELL'
+    if isinstance(side, Side):
+        return side
+    try:
+        return Side[side.upper()]
+    except (AttributeError, KeyError):
+        raise ValueError('Side must be BUY or SELL') from None
+
+
+_RECEIPT_IDS = itertools.count(1)  # receipt ids increase in submission order within a process
+
 
 # PriceBar is a container after getting the data
 class PriceBar:
+    __slots__ = ('date', 'open', 'close', 'high', 'low', 'volume')  # no per-bar __dict__
+
     def __init__(self, date, open_price, close_price, high_price, low_price, volume):
         self.date = date
         self.open = open_price
@@ -100,32 +445,89 @@ class PriceBar:
     def is_bearish(self):
         return self.open > self.close
 
+    # repr template and its fields are built once for the class, __repr__ only fills them in
+    _REPR = 'PriceBar(date={}, open={}, close={}, high={}, low={}, volume={})'
+    _REPR_FIELDS = operator.attrgetter('date', 'open', 'close', 'high', 'low', 'volume')
+
     def __repr__(self):
-        return (f'PriceBar(date={self.date}, open={self.open}, close={self.close}, '
-                f'high={self.high}, low={self.low}, volume={self.volume})')
+        return self._REPR.format(*self._REPR_FIELDS(self))
+
+
+# PriceBarFrame holds many bars column by column, so the bar checks run over whole arrays at once
+class PriceBarFrame:
+    __slots__ = ('date', 'open', 'close', 'high', 'low', 'volume')
+
+    def __init__(self, columns):
+        # columns: dict of array-likes with keys 'date', 'open', 'close', 'high', 'low', 'volume'
+        self.date = np.asarray(columns['date'])
+        self.open = np.asarray(columns['open'], dtype=np.float64)
+        self.close = np.asarray(columns['close'], dtype=np.float64)
+        self.high = np.asarray(columns['high'], dtype=np.float64)
+        self.low = np.asarray(columns['low'], dtype=np.float64)
+        self.volume = np.asarray(columns['volume'], dtype=np.float64)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        # accepts yahoo frames ('Date'/'Datetime', 'Open', ...) with the date either as a column or as the index
+        df = _drop_ticker_level(df)
+        if isinstance(df.columns, pd.MultiIndex):
+            raise ValueError('PriceBarFrame needs the bars of one ticker, select it first, e.g. df[ticker]')
+        by_name = {str(c).lower(): c for c in df.columns}
+        date_col = by_name.get('date', by_name.get('datetime'))
+        columns = {name: df[by_name[name]].values for name in ('open', 'close', 'high', 'low', 'volume')}
+        columns['date'] = df[date_col].values if date_col is not None else df.index.values
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.close)
+
+    def __getitem__(self, i):  # one row back as a PriceBar
+        return PriceBar(self.date[i], self.open[i], self.close[i], self.high[i], self.low[i], self.volume[i])
+
+    def mid_price(self):
+        return 0.5 * (self.high + self.low)
+
+    def is_bullish(self):
+        return self.open < self.close
+
+    def is_bearish(self):
+        return self.open > self.close
+
+    def __repr__(self):
+        return f'PriceBarFrame(bars={len(self)})'
 
 
 class TradeOrder:
+    __slots__ = ('symbol', 'side', 'quantity', 'order_type', 'price', 'timestamp', 'status')
+
     def __init__(self, symbol, side, quantity, order_type='market', price=None):
-        self.symbol = symbol.upper()
-        self.side = side.upper()  # 'BUY' or 'SELL'
+        self.symbol = sys.intern(symbol.upper())  # interned, equal symbols share one string object
+        self.side = _to_side(side)  # Side.BUY or Side.SELL
         self.quantity = quantity
         self.order_type = order_type.lower()
         self.price = price
         # These are now set internally, not passed as args
-        self.timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.timestamp = time.time_ns()  # int nanoseconds, see timestamp_str for the readable form
         self.status = 'pending'
 
+    @property
+    def timestamp_str(self):
+        return format_timestamp(self.timestamp)
+
     def cancel(self):
         if self.status == 'pending':
             self.status = 'cancelled'
 
+    _REPR = 'TradeOrder(symbol={}, side={.name}, quantity={}, type={}, price={}, status={})'
+    _REPR_FIELDS = operator.attrgetter('symbol', 'side', 'quantity', 'order_type', 'price', 'status')
+
     def __repr__(self):
-        return (f'TradeOrder(symbol={self.symbol}, side={self.side}, quantity={self.quantity}, '
-                f'type={self.order_type}, price={self.price}, status={self.status})')
+        return self._REPR.format(*self._REPR_FIELDS(self))
 
 
 class MarketOrder(TradeOrder):
+    __slots__ = ()
+
     def __init__(self, symbol, side, quantity):
         super().__init__(symbol, side, quantity, order_type='market')
 
@@ -135,32 +537,158 @@ class MarketOrder(TradeOrder):
 
 
 class LimitOrder(TradeOrder):
+    __slots__ = ()
+
     def __init__(self, symbol, side, quantity, limit_price):
         super().__init__(symbol, side, quantity, order_type='limit', price=limit_price)
 
     def execute(self, market_price):
-        if self.side == 'BUY' and market_price <= self.price:
+        if self.side is Side.BUY and market_price <= self.price:
             self.status = 'filled'
-        elif self.side == 'SELL' and market_price >= self.price:
+        elif self.side is Side.SELL and market_price >= self.price:
             self.status = 'filled'
 
 
+# LimitOrderBatch checks many limit orders against one market price without a python loop
+class LimitOrderBatch:
+    __slots__ = ('price', 'side_buy', 'status')
+
+    def __init__(self, price, side_buy, status=None):
+        self.price = np.asarray(price, dtype=np.float64)
+        self.side_buy = np.asarray(side_buy, dtype=bool)
+        if status is None:
+            status = np.full(len(self.price), STATUS_PENDING, dtype=np.uint8)
+        self.status = np.asarray(status, dtype=np.uint8)
+
+    @classmethod
+    def from_orders(cls, orders):
+        return cls([o.price for o in orders],
+                   [o.side is Side.BUY for o in orders],
+                   [STATUS_NAMES.index(o.status) for o in orders])
+
+    def execute(self, market_price):
+        # same rule as LimitOrder.execute, buys fill at or below the limit and sells at or above it
+        fill = np.where(self.side_buy, market_price <= self.price, market_price >= self.price)
+        self.status = np.where(fill & (self.status == STATUS_PENDING), STATUS_FILLED, self.status).astype(np.uint8)
+
+    def filled(self):
+        return self.status == STATUS_FILLED
+
+    def status_names(self):
+        return [STATUS_NAMES[s] for s in self.status]
+
+    def __len__(self):
+        return len(self.price)
+
+
 class OrderReceipt:
+    __slots__ = ('order_id', 'symbol', 'side', 'original_quantity', 'executed_quantity',
+                 'executed_price', 'timestamp', 'status')
+
     def __init__(self, symbol, side, order, timestamp, executed_price=None, executed_quantity=0, status='pending'):
-        self.order_id = id(order)
-        self.symbol = symbol.upper()
-        self.side = side.upper()
+        self.order_id = next(_RECEIPT_IDS)
+        # symbols taken from the order are already upper-case and interned
+        self.symbol = symbol if symbol is order.symbol else sys.intern(symbol.upper())
+        self.side = _to_side(side)
         self.original_quantity = order.quantity  # order here is an object from TradeOrder
         self.executed_quantity = executed_quantity
         self.executed_price = executed_price
         self.timestamp = timestamp  # Use passed timestamp
         self.status = status
 
+    @property
+    def timestamp_str(self):
+        return format_timestamp(self.timestamp)
+
+    _REPR = ('OrderReceipt(symbol={}, side={.name}, executed_qty={}/{}, '
+             'executed_price={}, status={}, timestamp={})')
+    _REPR_FIELDS = operator.attrgetter('symbol', 'side', 'executed_quantity', 'original_quantity',
+                                       'executed_price', 'status', 'timestamp_str')
+
     def __repr__(self):
-        return (f'OrderReceipt(symbol={self.symbol.upper()}, side={self.side.upper()}, '
-                f'executed_qty={self.executed_quantity}/{self.original_quantity}, '
-                f'executed_price={self.executed_price}, status={self.status}, '
-                f'timestamp={self.timestamp})')
+        return self._REPR.format(*self._REPR_FIELDS(self))
+
+
+# OrderBook keeps resting limit orders for one symbol in price-time priority:
+# a FIFO queue per price level, sorted price lists for the best bid/ask, and an id index for cancels
+class OrderBook:
+    def __init__(self):
+        self._bids = {}  # price -> deque of [order_id, order, remaining quantity]
+        self._asks = {}
+        self._bid_prices = []  # ascending, best bid is the last one
+        self._ask_prices = []  # ascending, best ask is the first one
+        self._by_id = {}  # order_id -> queue entry
+
+    def add(self, order, order_id):
+        levels, prices = (self._bids, self._bid_prices) if order.side is Side.BUY else (self._asks, self._ask_prices)
+        if order.price not in levels:
+            levels[order.price] = deque()
+            bisect.insort(prices, order.price)
+        entry = [order_id, order, order.quantity]
+        levels[order.price].append(entry)
+        self._by_id[order_id] = entry
+
+    def cancel(self, order_id):
+        # O(1): the entry is only emptied here, match() drops it when it reaches the front of its queue
+        entry = self._by_id.pop(order_id, None)
+        if entry is None:
+            return False
+        entry[2] = 0
+        entry[1].cancel()
+        return True
+
+    def remaining(self, order_id):
+        # quantity still open after partial fills, 0 once the order is filled, cancelled or unknown
+        entry = self._by_id.get(order_id)
+        return entry[2] if entry is not None and entry[1].status == 'pending' else 0
+
+    def __contains__(self, order_id):
+        entry = self._by_id.get(order_id)
+        return entry is not None and entry[1].status == 'pending'
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _front(self, levels, prices, best):
+        # first live entry at the best level, dropping cancelled entries and empty levels on the way.
+        # orders cancelled with TradeOrder.cancel() instead of cancel() are caught by their status here
+        while prices:
+            price = prices[best]
+            queue = levels[price]
+            while queue and (queue[0][2] == 0 or queue[0][1].status != 'pending'):
+                self._by_id.pop(queue.popleft()[0], None)
+            if queue:
+                return queue[0]
+            del levels[price]
+            prices.pop(best)
+        return None
+
+    def best_bid(self):
+        entry = self._front(self._bids, self._bid_prices, -1)
+        return entry[1].price if entry else None
+
+    def best_ask(self):
+        entry = self._front(self._asks, self._ask_prices, 0)
+        return entry[1].price if entry else None
+
+    def match(self):
+        # crosses the book while the best bid reaches the best ask, returns (buy_id, sell_id, price, quantity) tuples
+        executions = []
+        while True:
+            bid = self._front(self._bids, self._bid_prices, -1)
+            ask = self._front(self._asks, self._ask_prices, 0)
+            if bid is None or ask is None or bid[1].price < ask[1].price:
+                return executions
+
+            # the order that was resting first sets the trade price
+            price = bid[1].price if bid[0] < ask[0] else ask[1].price
+            quantity = min(bid[2], ask[2])
+            executions.append((bid[0], ask[0], price, quantity))
+            for entry in (bid, ask):
+                entry[2] -= quantity
+                if entry[2] == 0:
+                    entry[1].status = 'filled'
+                    del self._by_id[entry[0]]
 
 
 class IConnector:  # defines a contract for how your system talks to any broker.
@@ -175,47 +703,179 @@ class IConnector:  # defines a contract for how your system talks to any broker.
 
 
 class MockBrokerConnector(IConnector):  # provides a dummybroker
-    def __init__(self):
+    def __init__(self, history_size=ORDER_HISTORY_SIZE):
         self.cash_balance = 100000.0
-        self.positions = {}  # e.g., {'AAPL': 100}
-        self.order_history = []
+        self.positions = defaultdict(float)  # e.g., {'AAPL': 100}, missing symbols start at 0
+        self._hist = np.empty(history_size, dtype=ORDER_DTYPE)  # ring buffer, see order_history
+        self._hist_head = 0  # total orders written so far
+        self.symbols = []  # symbol table for the sym column of the history
+        self._symbol_codes = {}  # symbol -> index into self.symbols
+        # fills kept column by column (symbol, signed quantity, price) for vectorised totals,
+        # the arrays double in size when full and only the first _fill_count rows are used
+        self._fill_sym = np.empty(64, dtype=object)
+        self._fill_qty = np.empty(64, dtype=np.float64)
+        self._fill_px = np.empty(64, dtype=np.float64)
+        self._fill_count = 0
         self.current_market_price = 100.0  # Added for predictable testing
+        self.books = defaultdict(OrderBook)  # symbol -> resting limit orders
+        self._resting = {}  # receipt id -> [resting order, history slot, filled quantity, filled notional]
+        self._resting_orders = set()  # the resting order objects themselves, so one cannot rest twice
 
     def getMarketData(self, symbol, start_date, end_date):
-        dates = pd.date_range(start=start_date, end=end_date, freq='D')
-        prices = [100 + i * 0.5 for i in range(len(dates))]
-        df = pd.DataFrame({'date': dates, 'symbol': symbol, 'price': prices})
+        dates = _date_range(start_date, end_date, 'D')
+        prices = _fill_linear(len(dates))
+        df = pd.DataFrame({'date': dates.array, 'symbol': symbol, 'price': prices})
         return df
 
     def submitOrder(self, order):
+        if order in self._resting_orders:  # a second submit would let the same order fill twice
+            raise ValueError('Order is already resting in the book')
+
         # Use the broker's current market price
         order.execute(self.current_market_price)
-        self.order_history.append(order)
 
         if order.status == 'filled':
-            if order.side == 'BUY':
-                cost = order.price * order.quantity
-                self.cash_balance -= cost
-                self.positions[order.symbol] = self.positions.get(order.symbol, 0) + order.quantity
-            elif order.side == 'SELL':
-                revenue = order.price * order.quantity
-                self.cash_balance += revenue
-                self.positions[order.symbol] = self.positions.get(order.symbol, 0) - order.quantity
+            self._apply_fill(order.symbol, order.side, order.quantity, order.price)
 
         # Return a receipt
         receipt = OrderReceipt(
             symbol=order.symbol,
             side=order.side,
             order=order,
-            timestamp=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            timestamp=time.time_ns(),
             executed_price=order.price if order.status == 'filled' else None,
             executed_quantity=order.quantity if order.status == 'filled' else 0,
             status=order.status
         )
+        slot = self._record_order(order, receipt)
+
+        # limit orders that did not fill rest in the book until matched or cancelled
+        if order.status == 'pending' and order.order_type == 'limit':
+            self.books[order.symbol].add(order, receipt.order_id)
+            self._resting[receipt.order_id] = [order, slot, 0.0, 0.0]
+            self._resting_orders.add(order)
         return receipt
 
+    def cancelOrder(self, order_id):
+        resting = self._resting.pop(order_id, None)
+        if resting is None:
+            return False
+        order, slot = resting[:2]
+        self._resting_orders.discard(order)
+        cancelled = self.books[order.symbol].cancel(order_id)
+        self._update_history(slot, status=order.status)
+        return cancelled
+
+    def getOpenQuantity(self, order_id):
+        # how much of a resting limit order is still waiting in the book
+        resting = self._resting.get(order_id)
+        if resting is None:
+            return 0
+        return self.books[resting[0].symbol].remaining(order_id)
+
+    def matchOrders(self):
+        # crosses every symbol's book and books the resulting trades, returns {symbol: executions}
+        matched = {}
+        for symbol, book in self.books.items():
+            executions = book.match()
+            for buy_id, sell_id, price, quantity in executions:
+                self._apply_fill(symbol, Side.BUY, quantity, price)
+                self._apply_fill(symbol, Side.SELL, quantity, price)
+                for order_id in (buy_id, sell_id):
+                    # the trade price can differ from the limit, keep the average fill price in the history
+                    resting = self._resting[order_id]
+                    resting[2] += quantity
+                    resting[3] += quantity * price
+                    self._update_history(resting[1], px=resting[3] / resting[2])
+            if executions:
+                matched[symbol] = executions
+
+        # forget orders that are no longer pending: fully filled above, or cancelled on the order itself
+        for order_id, (order, slot, _, _) in list(self._resting.items()):
+            if order.status != 'pending':
+                del self._resting[order_id]
+                self._resting_orders.discard(order)
+                self._update_history(slot, status=order.status)
+        return matched
+
+    def _apply_fill(self, symbol, side, quantity, price):
+        if side is Side.BUY:
+            cost = price * quantity
+            self.cash_balance -= cost
+            self.positions[symbol] += quantity
+            self._record_fill(symbol, quantity, price)
+        elif side is Side.SELL:
+            revenue = price * quantity
+            self.cash_balance += revenue
+            self.positions[symbol] -= quantity
+            self._record_fill(symbol, -quantity, price)
+
+    def _record_order(self, order, receipt):
+        rec = self._hist[self._hist_head % len(self._hist)]
+        rec['id'] = receipt.order_id
+        rec['sym'] = self._symbol_code(order.symbol)
+        rec['side'] = order.side
+        rec['qty'] = order.quantity
+        rec['px'] = np.nan if order.price is None else order.price
+        rec['ts'] = receipt.timestamp
+        rec['status'] = STATUS_NAMES.index(order.status)
+        self._hist_head += 1
+        return self._hist_head - 1  # slot of this record, for later status updates
+
+    def _symbol_code(self, symbol):
+        code = self._symbol_codes.get(symbol)
+        if code is None:
+            code = self._symbol_codes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return code
+
+    def _update_history(self, slot, status=None, px=None):
+        if self._hist_head - slot > len(self._hist):  # skip records the ring buffer already overwrote
+            return
+        rec = self._hist[slot % len(self._hist)]
+        if status is not None:
+            rec['status'] = STATUS_NAMES.index(status)
+        if px is not None:
+            rec['px'] = px
+
+    @property
+    def order_history(self):
+        # structured array of ORDER_DTYPE records, oldest first; a view until the buffer wraps around
+        if self._hist_head <= len(self._hist):
+            return self._hist[:self._hist_head]
+        start = self._hist_head % len(self._hist)
+        return np.concatenate((self._hist[start:], self._hist[:start]))
+
+    def getOrderHistory(self, symbol=None):
+        # order_history, optionally only the records of one symbol
+        history = self.order_history
+        if symbol is None:
+            return history
+        code = self._symbol_codes.get(symbol.upper())
+        return history[history['sym'] == code] if code is not None else history[:0]
+
+    def _record_fill(self, symbol, signed_quantity, price):
+        n = self._fill_count
+        if n == len(self._fill_qty):
+            self._fill_sym = np.concatenate((self._fill_sym, np.empty(n, dtype=object)))
+            self._fill_qty = np.concatenate((self._fill_qty, np.empty(n, dtype=np.float64)))
+            self._fill_px = np.concatenate((self._fill_px, np.empty(n, dtype=np.float64)))
+        self._fill_sym[n] = symbol
+        self._fill_qty[n] = signed_quantity
+        self._fill_px[n] = price
+        self._fill_count = n + 1
+
+    def getNetCashFlow(self, symbol=None):
+        # cash paid out (negative) or received (positive) over all fills, optionally for one symbol
+        n = self._fill_count
+        qty, px = self._fill_qty[:n], self._fill_px[:n]
+        if symbol is not None:
+            mask = self._fill_sym[:n] == symbol.upper()
+            qty, px = qty[mask], px[mask]
+        return -float(np.dot(qty, px))
+
     def getAccountInfo(self):
         return {
             'cash_balance': self.cash_balance,
-            'positions': self.positions,
+            'positions': dict(self.positions),  # plain copy, reading it never adds symbols
             'order_history': self.order_history}
@@ -1,17 +1,118 @@
 import pytest
+import numpy as np
 import pandas as pd
 import datetime
+import os
+import threading
+import time
+import types
+import trading_system
 from trading_system import (
     MarketDataQuery,
     PriceBar,
+    PriceBarFrame,
     TradeOrder,
     MarketOrder,
     LimitOrder,
+    LimitOrderBatch,
     OrderReceipt,
-    MockBrokerConnector
+    OrderBook,
+    MockBrokerConnector,
+    STATUS_NAMES,
+    Side,
+    FileCache,
+    fetch_queries
 )
 
 
+# --- Helpers ---
+
+def yahoo_frame(tickers, index, group_by='column'):
+    """Builds a frame shaped like current yf.download output, (Price, Ticker) or (Ticker, Price) columns."""
+    prices = ['Open', 'High', 'Low', 'Close', 'Volume']
+    if group_by == 'ticker':
+        columns = pd.MultiIndex.from_product([tickers, prices], names=['Ticker', 'Price'])
+    else:
+        columns = pd.MultiIndex.from_product([prices, tickers], names=['Price', 'Ticker'])
+    values = np.arange(len(index) * len(columns), dtype=np.float64).reshape(len(index), len(columns)) + 100.0
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+class FakeYF:
+    """Stands in for the yfinance module and records every download and history call."""
+
+    def __init__(self):
+        self.calls = []
+        self.index = pd.DatetimeIndex(['2023-01-03', '2023-01-04'], name='Date')
+        self.empty = False  # mimic a failed download, which yfinance reports as an empty frame
+        self.barrier = None  # set to a threading.Barrier to require that history calls overlap
+        self.active = 0
+        self.max_active = 0  # most downloads seen running at the same time
+        self._lock = threading.Lock()
+
+    def download(self, tickers, **kwargs):
+        with self._lock:
+            self.calls.append(tickers)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        with self._lock:
+            self.active -= 1
+        if self.empty:
+            return pd.DataFrame()
+        return yahoo_frame(tickers.split(), self.index, kwargs.get('group_by', 'column'))
+
+    def Ticker(self, symbol):
+        return FakeTicker(self, symbol)
+
+
+class FakeTicker:
+    """Stands in for yf.Ticker, history() returns flat columns like yfinance does."""
+
+    def __init__(self, yf_stub, symbol):
+        self.yf_stub = yf_stub
+        self.symbol = symbol
+
+    def history(self, start=None, end=None, interval='1d'):
+        stub = self.yf_stub
+        with stub._lock:
+            stub.calls.append(self.symbol)
+        if stub.barrier is not None:
+            stub.barrier.wait()
+        if stub.empty:
+            return pd.DataFrame()
+        return yahoo_frame([self.symbol], stub.index).droplevel(1, axis=1)
+
+
+@pytest.fixture
+def fake_yf(monkeypatch, tmp_path):
+    """Replaces yfinance with FakeYF and points the yahoo disk cache at a temp dir."""
+    stub = FakeYF()
+    monkeypatch.setattr(trading_system, 'yf', stub)
+    monkeypatch.setattr(trading_system, 'yahoo_cache', FileCache(str(tmp_path / 'yahoo')))
+    trading_system._yahoo_memory.clear()
+    yield stub
+    trading_system._yahoo_memory.clear()
+
+
+class FakeSparkResponse:
+    """Stands in for the requests response of the spark endpoint."""
+
+    def __init__(self, symbols, timestamps):
+        self.symbols = symbols
+        self.timestamps = timestamps
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        closes = [float(i) for i in range(len(self.timestamps))]
+        return {'spark': {'result': [
+            {'symbol': sym, 'response': [{'timestamp': self.timestamps,
+                                          'indicators': {'quote': [{'close': closes}]}}]}
+            for sym in self.symbols]}}
+
+
 # --- Tests ---
 
 def test_market_data_query_test_source_daily():
@@ -55,12 +156,34 @@ def test_market_data_query_test_source_weekly():
     assert df['price'].iloc[-1] == 102.0  # 100 + 4 * 0.5
 
 
+def test_market_data_query_test_source_intraday():
+    """Tests the 'test' source for fixed-step intraday freqs."""
+    query = MarketDataQuery('TEST', 'H1', '2023-01-01', '2023-01-02', frequency='1h', source='test')
+    df = query.fetch()
+
+    assert len(df) == 25  # both midnights included
+    assert df['date'].iloc[1] == pd.Timestamp('2023-01-01 01:00')
+    assert df['date'].iloc[-1] == pd.Timestamp('2023-01-02 00:00')
+    assert df['price'].iloc[-1] == 112.0  # 100 + 24 * 0.5
+
+    query = MarketDataQuery('TEST', 'M90', '2023-01-01', '2023-01-02', frequency='90m', source='test')
+    assert len(query.fetch()) == 17  # every 90 minutes up to 00:00 the next day
+
+
 def test_market_data_query_validation():
     """Tests the validation logic in MarketDataQuery."""
     # Test invalid date range
     with pytest.raises(ValueError, match='Start date must be before end date'):
         MarketDataQuery('TEST', 'D1', '2023-01-05', '2023-01-01')
 
+    # Test missing or non-date start/end
+    for start in ('', None, '2023-01-01 15:30', '2023-01-01T00:00:00+05:00', '2023/01/01', 'Jan 1 2023',
+                  '20230101', '01/02/2023', datetime.datetime(2023, 1, 1, 15, 30)):
+        with pytest.raises(ValueError, match='plain dates'):
+            MarketDataQuery('TEST', 'D1', start, '2023-01-05', source='test')
+    with pytest.raises(ValueError, match='plain dates'):
+        MarketDataQuery('TEST', 'D1', '2023-01-01', '', source='test')
+
     # Test invalid frequency
     with pytest.raises(ValueError, match="Frequency must be one of .* '3mo'"):
         MarketDataQuery('TEST', 'D1', '2023-01-01', '2023-01-05', frequency='yearly')
@@ -71,6 +194,187 @@ def test_market_data_query_validation():
         query.fetch()
 
 
+def test_market_data_query_many_symbols():
+    """Tests that a list of symbols returns one DataFrame per symbol."""
+    query = MarketDataQuery(['AAA', 'BBB'], 'D1', '2023-01-01', '2023-01-05', source='test')
+    frames = query.fetch()
+
+    assert set(frames) == {'AAA', 'BBB'}
+    assert len(frames['AAA']) == 5
+    assert frames['BBB']['price'].iloc[-1] == 102.0
+    assert query.symbol == ['AAA', 'BBB']  # the query itself is left untouched
+
+
+def test_market_data_query_many_symbols_yahoo(fake_yf):
+    """Tests that yahoo symbols are downloaded in batches of 20 and split per symbol."""
+    symbols = ['sym%d' % i for i in range(24)] + ['AAPL']
+    query = MarketDataQuery(symbols, 'D1', '2023-01-01', '2023-01-05')
+    frames = query.fetch()
+
+    assert len(fake_yf.calls) == 2
+    assert fake_yf.calls[0].split() == [sym.upper() for sym in symbols[:20]]
+    assert len(fake_yf.calls[1].split()) == 5
+    assert list(frames) == symbols  # keyed the way the caller wrote them
+    assert list(frames['sym3'].columns) == ['date', 'Open', 'High', 'Low', 'Close', 'Volume']
+    assert frames['AAPL']['date'].tolist() == list(fake_yf.index)
+    assert frames['sym0']['Open'].iloc[0] != frames['sym1']['Open'].iloc[0]  # each symbol gets its own slice
+
+
+def test_market_data_query_spark(monkeypatch):
+    """Tests the spark source with requests.get stubbed out."""
+    days = pd.date_range('2023-01-02', periods=5, freq='D')
+    timestamps = [int(ts.timestamp()) for ts in days]
+    requested = []
+
+    def fake_get(url, params=None, **kwargs):
+        requested.append(params)
+        # yahoo leaves unknown symbols out of the result
+        return FakeSparkResponse([s for s in params['symbols'].split(',') if s != 'NOPE'], timestamps)
+
+    monkeypatch.setattr(trading_system, 'requests', types.SimpleNamespace(get=fake_get))
+
+    query = MarketDataQuery('aapl', 'D1', '2023-01-03', '2023-01-05', source='spark')
+    df = query.fetch()
+    assert requested[0]['symbols'] == 'AAPL'
+    assert requested[0]['interval'] == '1d'
+    assert df['date'].tolist() == list(days[1:3])  # end date is exclusive
+    assert df['close'].tolist() == [1.0, 2.0]
+
+    frames = MarketDataQuery(['msft', 'AMD'], 'D1', '2023-01-02', '2023-01-07', source='spark').fetch()
+    assert list(frames) == ['msft', 'AMD']
+    assert len(frames['msft']) == 5
+
+    with pytest.raises(ValueError, match='no data for symbol: nope'):
+        MarketDataQuery(['AMD', 'nope'], 'D1', '2023-01-02', '2023-01-07', source='spark').fetch()
+
+
+def test_fetch_queries_threaded():
+    """Tests that threaded fetches come back in the order of the queries."""
+    queries = [
+        MarketDataQuery('TEST', 'D1', '2023-01-01', '2023-01-05', source='test'),
+        MarketDataQuery('TEST', 'W1', '2023-01-01', '2023-01-31', frequency='1wk', source='test'),
+        MarketDataQuery('TEST', 'D1', '2023-01-01', '2023-01-02', source='test'),
+    ]
+    results = fetch_queries(queries, threads=2)
+
+    assert [len(df) for df in results] == [5, 5, 2]
+    assert fetch_queries([]) == []
+
+
+def test_fetch_queries_parallel_yahoo(fake_yf):
+    """Tests that single-symbol yahoo queries download at the same time."""
+    fake_yf.barrier = threading.Barrier(4, timeout=5)  # breaks unless all four are in flight together
+    queries = [MarketDataQuery(sym, 'D1', '2023-01-01', '2023-01-05') for sym in ('AAPL', 'MSFT', 'AMD', 'TSLA')]
+    results = fetch_queries(queries, threads=4)
+
+    assert sorted(fake_yf.calls) == ['AAPL', 'AMD', 'MSFT', 'TSLA']
+    assert [len(df) for df in results] == [2, 2, 2, 2]
+    assert results[1]['Close'].tolist() == [103.0, 108.0]
+
+
+def test_fetch_queries_serializes_batches(fake_yf):
+    """Tests that threaded multi-symbol queries never run yf.download at the same time."""
+    queries = [MarketDataQuery(['AAPL', 'MSFT'], 'D1', '2023-01-01', '2023-01-05'),
+               MarketDataQuery(['AMD', 'TSLA'], 'D1', '2023-01-01', '2023-01-05'),
+               MarketDataQuery(['IBM', 'INTC'], 'D1', '2023-01-01', '2023-01-05')]
+    results = fetch_queries(queries, threads=3)
+
+    assert len(fake_yf.calls) == 3
+    assert fake_yf.max_active == 1
+    assert list(results[2]) == ['IBM', 'INTC']
+
+
+def test_file_cache(tmp_path):
+    """Tests the disk cache round trip and expiry."""
+    cache = FileCache(str(tmp_path / 'yahoo'))
+    df = pd.DataFrame({'date': pd.date_range('2023-01-01', periods=3), 'Close': [1.0, 2.0, 3.0]})
+
+    assert cache.get('AAPL|2023-01-01|2023-01-05|1d') is None
+    cache.set('AAPL|2023-01-01|2023-01-05|1d', df)
+    pd.testing.assert_frame_equal(cache.get('AAPL|2023-01-01|2023-01-05|1d', ttl=60), df)
+    assert cache.get('AAPL|2023-01-01|2023-01-05|1d', ttl=-1) is None  # expired
+    assert cache.get('MSFT|2023-01-01|2023-01-05|1d') is None
+
+    # a truncated pickle behind a fresh sidecar is a miss, not an error
+    data_path, _ = cache._paths('AAPL|2023-01-01|2023-01-05|1d')
+    open(data_path, 'wb').close()
+    assert cache.get('AAPL|2023-01-01|2023-01-05|1d') is None
+    assert not list((tmp_path / 'yahoo').glob('*.tmp'))  # temp files were all swapped in
+
+
+def test_yahoo_failed_download_not_cached(fake_yf):
+    """Tests that an empty (failed) yahoo download is not written to the disk cache."""
+    fake_yf.empty = True
+    query = MarketDataQuery('AAPL', 'D1', '2023-01-01', '2023-01-05')
+
+    assert query.fetch().empty
+    assert not os.path.exists(trading_system.yahoo_cache.directory)  # nothing was written
+
+
+def test_yahoo_recent_window_disk_ttl(fake_yf, monkeypatch):
+    """Tests that windows ending today are not served from day-old disk entries."""
+    today = datetime.date.today()
+    recent = MarketDataQuery('AAPL', 'D1', (today - datetime.timedelta(days=5)).isoformat(), today.isoformat())
+    past = MarketDataQuery('AAPL', 'D1', '2023-01-01', '2023-01-05')
+    recent.fetch()
+    past.fetch()
+
+    monkeypatch.setattr(trading_system, 'YAHOO_RECENT_TTL', -1)  # pretend the recent entry has aged
+    trading_system._yahoo_memory.clear()  # look at the disk cache only
+    recent.fetch()
+    past.fetch()
+    assert fake_yf.calls == ['AAPL', 'AAPL', 'AAPL']  # only the recent window was downloaded again
+
+
+def test_yahoo_recent_window_memory_ttl(fake_yf, monkeypatch):
+    """Tests that the in-memory copy of a window ending today expires with the short limit too."""
+    today = datetime.date.today().isoformat()
+    query = MarketDataQuery('AAPL', 'D1', '2023-01-01', today)
+    query.fetch()
+
+    monkeypatch.setattr(trading_system, 'YAHOO_RECENT_TTL', -1)
+    query.fetch()  # memory and disk both count as expired
+    assert fake_yf.calls == ['AAPL', 'AAPL']
+
+
+def test_yahoo_download_memoized(fake_yf, monkeypatch):
+    """Tests that repeated yahoo queries hit the network once and callers get their own copy."""
+    query = MarketDataQuery('AAPL', 'D1', '2023-01-01', '2023-01-05')
+    first = query.fetch()
+    first['Close'] = 0.0  # must not leak into the cached frame
+    second = query.fetch()
+
+    assert fake_yf.calls == ['AAPL']
+    assert second['Close'].tolist() == [103.0, 108.0]
+
+    # once the in-memory copy expires the disk cache answers for this past window, still without a download
+    monkeypatch.setattr(trading_system, 'YAHOO_MEMORY_TTL', -1)
+    assert len(query.fetch()) == 2
+    assert fake_yf.calls == ['AAPL']
+
+    # failed downloads are retried rather than remembered
+    fake_yf.empty = True
+    failing = MarketDataQuery('MSFT', 'D1', '2023-01-01', '2023-01-05')
+    failing.fetch()
+    failing.fetch()
+    assert fake_yf.calls == ['AAPL', 'MSFT', 'MSFT']
+
+
+def test_yahoo_frame_layout(fake_yf):
+    """Tests that yahoo results keep the index timezone and lose the single ticker column level."""
+    fake_yf.index = pd.DatetimeIndex(['2023-01-03 09:30', '2023-01-03 09:31'], name='Datetime',
+                                     tz='America/New_York')
+    query = MarketDataQuery('AAPL', 'M1', '2023-01-03', '2023-01-04', frequency='1m')
+    df = query.fetch()
+
+    assert list(df.columns) == ['date', 'Open', 'High', 'Low', 'Close', 'Volume']
+    assert df['date'].iloc[0] == pd.Timestamp('2023-01-03 09:30', tz='America/New_York')
+    assert str(df['date'].dt.tz) == 'America/New_York'
+
+    frame = PriceBarFrame.from_dataframe(df)
+    assert frame.close.tolist() == [103.0, 108.0]
+
+
 def test_price_bar():
     """Tests the PriceBar class methods."""
     # Bullish bar
@@ -84,22 +388,63 @@ def test_price_bar():
     assert not bear_bar.is_bullish()
     assert bear_bar.is_bearish()
 
+    assert not hasattr(bull_bar, '__dict__')  # slotted container
+    assert repr(bull_bar) == 'PriceBar(date=2023-01-01, open=100, close=110, high=115, low=95, volume=1000)'
+
     # Doji (neutral)
     doji_bar = PriceBar('2023-01-03', 100, 100, 105, 95, 1000)
     assert not doji_bar.is_bullish()
     assert not doji_bar.is_bearish()
 
 
+def test_price_bar_frame():
+    """Tests the columnar PriceBarFrame against the same bars as test_price_bar."""
+    df = pd.DataFrame({
+        'Date': pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-03']),
+        'Open': [100, 110, 100],
+        'Close': [110, 100, 100],
+        'High': [115, 115, 105],
+        'Low': [95, 95, 95],
+        'Volume': [1000, 1000, 1000],
+    })
+    frame = PriceBarFrame.from_dataframe(df)
+
+    assert len(frame) == 3
+    assert frame.is_bullish().tolist() == [True, False, False]
+    assert frame.is_bearish().tolist() == [False, True, False]
+    assert frame.mid_price().tolist() == [105.0, 105.0, 100.0]
+
+    # date kept as the index, like a raw yf.download result
+    indexed = PriceBarFrame.from_dataframe(df.set_index('Date'))
+    assert (indexed.date == frame.date).all()
+
+    # yahoo MultiIndex layouts: one ticker in either level order works, several tickers are refused
+    index = pd.DatetimeIndex(['2023-01-03', '2023-01-04'], name='Date')
+    for group_by in ('column', 'ticker'):
+        single = PriceBarFrame.from_dataframe(yahoo_frame(['AAPL'], index, group_by))
+        assert single.close.tolist() == [103.0, 108.0]
+        assert single.mid_price().shape == (2,)
+        with pytest.raises(ValueError, match='one ticker'):
+            PriceBarFrame.from_dataframe(yahoo_frame(['AAPL', 'MSFT'], index, group_by))
+
+    bar = frame[0]
+    assert isinstance(bar, PriceBar)
+    assert bar.is_bullish()
+    assert bar.mid_price() == frame.mid_price()[0]
+
+
 def test_trade_order():
     """Tests the base TradeOrder class."""
     order = TradeOrder('AAPL', 'buy', 100)
 
     # Test init
     assert order.symbol == 'AAPL'
-    assert order.side == 'BUY'
+    assert order.side is Side.BUY
     assert order.status == 'pending'
     assert order.order_type == 'market'
-    assert isinstance(order.timestamp, str)
+    assert isinstance(order.timestamp, int)  # nanoseconds since the epoch
+    assert isinstance(order.timestamp_str, str)
+    assert order.timestamp_str == datetime.datetime.fromtimestamp(order.timestamp / 1e9).strftime('%Y-%m-%d %H:%M:%S')
 
     # Test cancel pending
     order.cancel()
@@ -113,6 +458,16 @@ def test_trade_order():
     # Test repr
     assert 'TradeOrder' in repr(order)
     assert 'AAPL' in repr(order)
+    assert 'side=BUY' in repr(order)
+
+    # Sides can also be given as the enum, symbols are interned
+    assert TradeOrder('aapl', Side.SELL, 1).side is Side.SELL
+    assert TradeOrder('aapl', 'sell', 1).symbol is order.symbol
+
+    # Invalid sides
+    for side in ('hold', 1, None):
+        with pytest.raises(ValueError, match='Side must be BUY or SELL'):
+            TradeOrder('AAPL', side, 1)
 
 
 def test_market_order():
@@ -121,7 +476,7 @@ def test_market_order():
 
     # Test init
     assert order.symbol == 'MSFT'
-    assert order.side == 'SELL'
+    assert order.side is Side.SELL
     assert order.quantity == 50
     assert order.order_type == 'market'
     assert order.status == 'pending'
@@ -167,6 +522,31 @@ def test_limit_order():
     assert sell_order.status == 'filled'
 
 
+def test_limit_order_batch():
+    """Tests that a batch fills exactly the orders LimitOrder.execute would."""
+    orders = [
+        LimitOrder('GOOG', 'buy', 10, 150.00),
+        LimitOrder('GOOG', 'buy', 10, 149.00),
+        LimitOrder('TSLA', 'sell', 5, 150.00),
+        LimitOrder('TSLA', 'sell', 5, 151.00),
+        LimitOrder('AMD', 'buy', 1, 200.00),
+    ]
+    orders[4].cancel()
+    batch = LimitOrderBatch.from_orders(orders)
+
+    batch.execute(150.00)
+    for order in orders[:4]:
+        order.execute(150.00)
+
+    assert batch.status_names()[:4] == [order.status for order in orders[:4]]
+    assert batch.filled().tolist() == [True, False, True, False, False]
+    assert batch.status_names()[4] == 'cancelled'  # cancelled orders never fill
+
+    # already filled orders stay filled when the price moves away
+    batch.execute(152.00)
+    assert batch.filled().tolist() == [True, False, True, True, False]
+
+
 def test_order_receipt():
     """Tests the OrderReceipt data container."""
     order = MarketOrder('AMD', 'buy', 20)
@@ -183,7 +563,9 @@ def test_order_receipt():
         status=order.status
     )
 
-    assert receipt.order_id == id(order)
+    second = OrderReceipt(order.symbol, order.side, order, '2023-01-01 12:00:01')
+    assert isinstance(receipt.order_id, int)
+    assert second.order_id == receipt.order_id + 1
     assert receipt.symbol == 'AMD'
     assert receipt.original_quantity == 20
     assert receipt.executed_quantity == 20
@@ -192,6 +574,49 @@ def test_order_receipt():
     assert 'OrderReceipt' in repr(receipt)
 
 
+def test_order_book_price_time_priority():
+    """Tests that the book matches best price first, then oldest order first."""
+    book = OrderBook()
+    first_bid = LimitOrder('AAPL', 'buy', 10, 101.0)
+    second_bid = LimitOrder('AAPL', 'buy', 10, 101.0)
+    low_bid = LimitOrder('AAPL', 'buy', 10, 99.0)
+    book.add(first_bid, 1)
+    book.add(low_bid, 2)
+    book.add(second_bid, 3)
+    assert book.best_bid() == 101.0
+    assert book.match() == []  # nothing on the ask side yet
+
+    ask = LimitOrder('AAPL', 'sell', 15, 100.0)
+    book.add(ask, 4)
+    executions = book.match()
+
+    # the resting bids set the price, the older bid at 101 is filled first
+    assert executions == [(1, 4, 101.0, 10), (3, 4, 101.0, 5)]
+    assert first_bid.status == 'filled'
+    assert ask.status == 'filled'
+    assert second_bid.status == 'pending'  # 5 of 10 left
+    assert book.remaining(3) == 5
+    assert book.remaining(1) == 0  # filled
+    assert book.best_ask() is None
+    assert len(book) == 2
+
+
+def test_order_book_cancel():
+    """Tests that cancelled orders are skipped when matching."""
+    book = OrderBook()
+    bid = LimitOrder('AAPL', 'buy', 10, 101.0)
+    book.add(bid, 1)
+
+    assert book.cancel(1)
+    assert not book.cancel(1)  # already gone
+    assert bid.status == 'cancelled'
+    assert 1 not in book
+
+    book.add(LimitOrder('AAPL', 'sell', 10, 100.0), 2)
+    assert book.match() == []
+    assert book.best_bid() is None
+
+
 # --- Test Class for MockBroker ---
 
 class TestMockBroker:
@@ -204,7 +629,7 @@ class TestMockBroker:
         """Tests the initial state of the MockBrokerConnector."""
         assert self.broker.cash_balance == 100000.0
         assert self.broker.positions == {}
-        assert self.broker.order_history == []
+        assert len(self.broker.order_history) == 0
 
     def test_mock_broker_market_data(self):
         """Tests the mock market data generation."""
@@ -213,6 +638,21 @@ class TestMockBroker:
         assert len(df) == 5
         assert 'price' in df.columns
 
+    def test_mock_broker_market_data_edge_dates(self):
+        """Tests that tz-aware and missing dates behave like pd.date_range."""
+        start = pd.Timestamp('2023-01-01', tz='America/New_York')
+        df = self.broker.getMarketData('TEST', start, start + pd.Timedelta(days=2))
+        assert df['date'].tolist() == list(pd.date_range(start, periods=3, freq='D'))
+
+        with pytest.raises(ValueError):
+            self.broker.getMarketData('TEST', '', '2023-01-05')
+
+        # outside the nanosecond range pandas raises OutOfBoundsDatetime, a ValueError
+        with pytest.raises(ValueError):
+            self.broker.getMarketData('TEST', '1500-01-01', '1500-01-05')
+        with pytest.raises(ValueError):
+            MarketDataQuery('TEST', 'D1', '1500-01-01', '1500-01-05', source='test').fetch()
+
     def test_mock_broker_submit_market_buy(self):
         """Tests submitting a successful market BUY order."""
         order = MarketOrder('AAPL', 'buy', 10)
@@ -223,9 +663,18 @@ class TestMockBroker:
         assert self.broker.cash_balance == 100000.0 - (100.0 * 10)
         # --- FIX: Test for QUANTITY (10 shares), not cost (1000.0) ---
         assert self.broker.positions['AAPL'] == 10
-        assert order in self.broker.order_history
+        assert self.broker.order_history[-1]['id'] == receipt.order_id
         assert receipt.status == 'filled'
         assert receipt.executed_quantity == 10
+        assert isinstance(receipt.timestamp, int)
+        assert receipt.timestamp_str in repr(receipt)
+
+        record = self.broker.order_history[-1]
+        assert record['side'] == Side.BUY
+        assert record['qty'] == 10
+        assert record['px'] == 100.0
+        assert record['ts'] == receipt.timestamp
+        assert STATUS_NAMES[record['status']] == 'filled'
 
     def test_mock_broker_submit_market_sell(self):
         """Tests submitting a successful market SELL order."""
@@ -237,7 +686,7 @@ class TestMockBroker:
         assert self.broker.cash_balance == 100000.0 + (100.0 * 5)
         # --- FIX: Test for QUANTITY (-5 shares), not cost (-500.0) ---
         assert self.broker.positions['MSFT'] == -5
-        assert order in self.broker.order_history
+        assert self.broker.order_history[-1]['id'] == receipt.order_id
         assert receipt.status == 'filled'
         assert receipt.executed_quantity == 5
 
@@ -250,10 +699,155 @@ class TestMockBroker:
         assert order.status == 'pending'
         assert self.broker.cash_balance == 100000.0  # No change
         assert 'TSLA' not in self.broker.positions
-        assert order in self.broker.order_history
+        assert self.broker.order_history[-1]['id'] == receipt.order_id
         assert receipt.status == 'pending'
         assert receipt.executed_quantity == 0
 
+    def test_mock_broker_net_cash_flow(self):
+        """Tests the vectorised cash flow over filled orders."""
+        self.broker.submitOrder(MarketOrder('AAPL', 'buy', 10))
+        self.broker.submitOrder(MarketOrder('MSFT', 'sell', 4))
+        self.broker.submitOrder(LimitOrder('TSLA', 'buy', 10, 95.0))  # stays pending
+
+        assert self.broker.getNetCashFlow() == -600.0
+        assert self.broker.getNetCashFlow('aapl') == -1000.0
+        assert self.broker.getNetCashFlow('TSLA') == 0.0
+        assert self.broker.cash_balance == 100000.0 + self.broker.getNetCashFlow()
+
+        # the fill columns grow past their initial size
+        for _ in range(100):
+            self.broker.submitOrder(MarketOrder('AMD', 'buy', 1))
+        assert self.broker.getNetCashFlow('AMD') == -10000.0
+        assert self.broker.getNetCashFlow() == -10600.0
+
+    def test_mock_broker_resting_limit_orders(self):
+        """Tests that unfilled limit orders rest in the book and can cross later."""
+        buy_receipt = self.broker.submitOrder(LimitOrder('TSLA', 'buy', 10, 95.0))
+        self.broker.current_market_price = 90.0
+        sell_receipt = self.broker.submitOrder(LimitOrder('TSLA', 'sell', 4, 94.0))
+        assert buy_receipt.status == 'pending'
+        assert sell_receipt.status == 'pending'
+
+        matched = self.broker.matchOrders()
+
+        # the resting buy was first, so its price is used
+        assert matched == {'TSLA': [(buy_receipt.order_id, sell_receipt.order_id, 95.0, 4)]}
+        assert self.broker.positions['TSLA'] == 0  # both sides are this same account
+        assert self.broker.cash_balance == 100000.0
+        assert self.broker.matchOrders() == {}
+
+        assert self.broker.cancelOrder(buy_receipt.order_id)
+        assert not self.broker.cancelOrder(sell_receipt.order_id)  # already filled
+
+        # the history records follow the orders after submission
+        statuses = {rec['id']: STATUS_NAMES[rec['status']] for rec in self.broker.order_history}
+        assert statuses == {buy_receipt.order_id: 'cancelled', sell_receipt.order_id: 'filled'}
+
+    def test_mock_broker_order_cancelled_directly(self):
+        """Tests that an order cancelled with TradeOrder.cancel() is never matched."""
+        buy = LimitOrder('TSLA', 'buy', 10, 95.0)
+        buy_receipt = self.broker.submitOrder(buy)
+        buy.cancel()
+        self.broker.current_market_price = 90.0
+        sell_receipt = self.broker.submitOrder(LimitOrder('TSLA', 'sell', 10, 94.0))
+
+        assert self.broker.matchOrders() == {}
+        assert buy.status == 'cancelled'
+        assert 'TSLA' not in self.broker.positions
+        assert self.broker.cash_balance == 100000.0
+        assert self.broker.getOpenQuantity(buy_receipt.order_id) == 0
+        assert self.broker.getOpenQuantity(sell_receipt.order_id) == 10
+        assert STATUS_NAMES[self.broker.order_history[0]['status']] == 'cancelled'
+
+    def test_mock_broker_order_rests_once(self):
+        """Tests that a resting order cannot be submitted again."""
+        order = LimitOrder('TSLA', 'buy', 10, 95.0)
+        receipt = self.broker.submitOrder(order)
+
+        with pytest.raises(ValueError, match='already resting'):
+            self.broker.submitOrder(order)
+        assert len(self.broker.books['TSLA']) == 1
+
+        # once it has left the book it is an ordinary order again
+        self.broker.cancelOrder(receipt.order_id)
+        order.status = 'pending'
+        self.broker.submitOrder(order)
+        assert len(self.broker.books['TSLA']) == 1
+
+    def test_mock_broker_partial_fill(self):
+        """Tests that a partly matched limit order keeps resting with its open quantity."""
+        buy = LimitOrder('TSLA', 'buy', 10, 95.0)
+        buy_receipt = self.broker.submitOrder(buy)
+        assert self.broker.getOpenQuantity(buy_receipt.order_id) == 10
+
+        self.broker.current_market_price = 90.0
+        self.broker.submitOrder(LimitOrder('TSLA', 'sell', 4, 94.0))
+        self.broker.matchOrders()
+
+        assert buy.status == 'pending'
+        assert self.broker.getOpenQuantity(buy_receipt.order_id) == 6
+        assert STATUS_NAMES[self.broker.order_history[0]['status']] == 'pending'
+
+        self.broker.submitOrder(LimitOrder('TSLA', 'sell', 6, 93.0))
+        self.broker.matchOrders()
+
+        assert buy.status == 'filled'
+        assert self.broker.getOpenQuantity(buy_receipt.order_id) == 0
+        assert STATUS_NAMES[self.broker.order_history[0]['status']] == 'filled'
+
+    def test_mock_broker_history_fill_price(self):
+        """Tests that a matched limit order is recorded at its average fill price, not its limit."""
+        self.broker.current_market_price = 100.0
+        self.broker.submitOrder(LimitOrder('TSLA', 'sell', 4, 110.0))
+        self.broker.submitOrder(LimitOrder('TSLA', 'sell', 6, 120.0))
+        self.broker.current_market_price = 140.0
+        self.broker.submitOrder(LimitOrder('TSLA', 'buy', 10, 130.0))
+        assert self.broker.order_history[2]['px'] == 130.0
+
+        self.broker.matchOrders()
+
+        history = self.broker.order_history
+        assert history['px'].tolist() == [110.0, 120.0, 116.0]
+        assert [STATUS_NAMES[st] for st in history['status']] == ['filled', 'filled', 'filled']
+
+    def test_mock_broker_history_by_symbol(self):
+        """Tests that the history records each order's symbol and can be filtered by it."""
+        self.broker.submitOrder(MarketOrder('AAPL', 'buy', 1))
+        self.broker.submitOrder(MarketOrder('msft', 'buy', 2))
+        self.broker.submitOrder(MarketOrder('AAPL', 'sell', 3))
+
+        history = self.broker.order_history
+        assert [self.broker.symbols[code] for code in history['sym']] == ['AAPL', 'MSFT', 'AAPL']
+        assert self.broker.getOrderHistory('aapl')['qty'].tolist() == [1, 3]
+        assert self.broker.getOrderHistory('MSFT')['qty'].tolist() == [2]
+        assert len(self.broker.getOrderHistory('GOOG')) == 0
+        assert len(self.broker.getOrderHistory()) == 3
+
+    def test_mock_broker_history_ring_buffer(self):
+        """Tests that the order history keeps the newest orders once it is full."""
+        broker = MockBrokerConnector(history_size=3)
+        receipts = [broker.submitOrder(MarketOrder('AAPL', 'buy', q)) for q in range(1, 6)]
+
+        history = broker.order_history
+        assert len(history) == 3
+        assert history['id'].tolist() == [r.order_id for r in receipts[2:]]
+        assert history['qty'].tolist() == [3, 4, 5]
+
+        # cancelling an order whose record was overwritten leaves the newer records alone
+        small = MockBrokerConnector(history_size=2)
+        resting = small.submitOrder(LimitOrder('AAPL', 'buy', 1, 50.0))
+        small.submitOrder(MarketOrder('AAPL', 'buy', 1))
+        small.submitOrder(MarketOrder('AAPL', 'buy', 1))
+        assert small.cancelOrder(resting.order_id)
+        assert [STATUS_NAMES[st] for st in small.order_history['status']] == ['filled', 'filled']
+
+    def test_mock_broker_history_fractional_quantity(self):
+        """Tests that fractional quantities are recorded in full."""
+        self.broker.submitOrder(MarketOrder('X', 'buy', 0.5))
+
+        assert self.broker.positions['X'] == 0.5
+        assert self.broker.order_history[-1]['qty'] == 0.5
+
     def test_mock_broker_account_info(self):
         """Tests the getAccountInfo method."""
         self.broker.cash_balance = 5000.0
@@ -263,4 +857,10 @@ class TestMockBroker:
 
         assert info['cash_balance'] == 5000.0
         assert info['positions']['XYZ'] == 1234.5
-        assert info['order_history'] == []
\ No newline at end of file
+        assert type(info['positions']) is dict
+
+        # unknown symbols are missing, not silently added as 0.0
+        fresh = MockBrokerConnector().getAccountInfo()
+        with pytest.raises(KeyError):
+            fresh['positions']['ABC']
+        assert len(info['order_history']) == 0